@@ -1,7 +1,4 @@
 """DBus backed display management for Mutter"""
-from collections import defaultdict
-from logging import currentframe
-from Xlib import display
 import dbus
 from dbus.mainloop.glib import DBusGMainLoop
 from gi.repository import GLib
@@ -9,6 +6,25 @@ import os
 
 DBusGMainLoop(set_as_default = True)
 
+def _unwrap(value):
+    """Recursively convert dbus-python values to native Python types"""
+    if isinstance(value, dbus.Dictionary):
+        return {_unwrap(k): _unwrap(v) for k, v in value.items()}
+    if isinstance(value, dbus.Array):
+        return [_unwrap(v) for v in value]
+    if isinstance(value, dbus.Struct):
+        return tuple(_unwrap(v) for v in value)
+    if isinstance(value, dbus.Boolean):
+        return bool(value)
+    if isinstance(value, (dbus.String, dbus.ObjectPath, dbus.Signature)):
+        return str(value)
+    if isinstance(value, (dbus.Byte, dbus.Int16, dbus.Int32, dbus.Int64,
+                          dbus.UInt16, dbus.UInt32, dbus.UInt64)):
+        return int(value)
+    if isinstance(value, dbus.Double):
+        return float(value)
+    return value
+
 class DisplayMode:
     def __init__(self, mode_info):
         self.mode_info = mode_info
@@ -69,7 +85,7 @@ class DisplayConfig():
         proxy_obj = session_bus.get_object(self.namespace, self.dbus_path)
         self.interface = dbus.Interface(proxy_obj, dbus_interface=self.namespace)
         self.resources = self.interface.GetResources()
-        self.current_state = self.interface.GetCurrentState()
+        self.current_state = _unwrap(self.interface.GetCurrentState())
         self.config_serial = self.current_state[0]
 
     @property
@@ -4,25 +4,106 @@ Simply Import DisplayMode & DisplayConfig
 
 from application import DisplayMode
 from application import DisplayConfig
+from application import stop_worker
 
-from collections import defaultdict
-from logging import currentframe
-from Xlib import display
-import dbus
-from dbus.mainloop.glib import DBusGMainLoop
-from gi.repository import GLib
+from collections import deque
+from gi.repository import Gio, GLib
+import time
 
-DBusGMainLoop(set_as_default = True)
-
-def catchcall_signal_handler(*args, **kwargs):
-    display_config = DisplayConfig()
+def on_display_config_ready(display_config):
     # display_config.print_current_state()
     print(display_config.monitors_count)
 
-display_config = DisplayConfig()
+def on_display_config_error(error):
+    print("GetCurrentState failed:", error)
+
+# MonitorsChanged tends to arrive in bursts (several signals within
+# ~100ms when a monitor powers on). Bursts are collapsed into a single
+# refresh scheduled after an adaptive window: the 99th percentile of the
+# recent gaps between signals of a burst, clamped to these bounds. A
+# burst never delays its refresh by more than DEBOUNCE_MAX_MS overall.
+DEBOUNCE_MIN_MS = 50
+DEBOUNCE_MAX_MS = 500
+
+_signal_gaps = deque(maxlen=64)
+_last_signal = None
+_burst_start = None
+_pending_refresh = None
+
+def debounce_ms():
+    if not _signal_gaps:
+        return DEBOUNCE_MIN_MS
+    gaps = sorted(_signal_gaps)
+    p99 = gaps[min(len(gaps) - 1, int(len(gaps) * 0.99))]
+    return int(min(max(p99, DEBOUNCE_MIN_MS), DEBOUNCE_MAX_MS))
 
-bus = dbus.SessionBus()
-bus.add_signal_receiver(catchcall_signal_handler, dbus_interface="org.gnome.Mutter.DisplayConfig", signal_name='MonitorsChanged')
+def _do_refresh():
+    global _pending_refresh, _burst_start
+    _pending_refresh = None
+    _burst_start = None
+    display_config.refresh(on_display_config_ready, on_display_config_error)
+    return GLib.SOURCE_REMOVE
+
+def catchcall_signal_handler(*args, **kwargs):
+    global _last_signal, _burst_start, _pending_refresh
+    now = time.monotonic()
+    if _last_signal is not None:
+        gap = (now - _last_signal) * 1000
+        # only gaps inside a burst say anything about its length
+        if gap < DEBOUNCE_MAX_MS:
+            _signal_gaps.append(gap)
+    _last_signal = now
+    if _pending_refresh is not None:
+        GLib.source_remove(_pending_refresh)
+    else:
+        _burst_start = now
+    remaining = DEBOUNCE_MAX_MS - int((now - _burst_start) * 1000)
+    _pending_refresh = GLib.timeout_add(max(0, min(debounce_ms(), remaining)), _do_refresh)
+
+display_config = None
+bus = None
+loop = None
+_subscription = None
+
+def start():
+    """
+    Start watching MonitorsChanged. When called from a thread already
+    running a loop on the default main context (e.g. a Gtk app), only
+    the signal receiver is registered on it; otherwise a main loop runs
+    until stop() is called.
+    """
+    global display_config, bus, loop, _subscription
+    display_config = DisplayConfig()
+    bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+    _subscription = bus.signal_subscribe(
+        DisplayConfig.namespace,
+        DisplayConfig.namespace,
+        "MonitorsChanged",
+        DisplayConfig.dbus_path,
+        None,
+        Gio.DBusSignalFlags.NONE,
+        catchcall_signal_handler,
+    )
+    if GLib.MainContext.default().is_owner():
+        return
+    loop = GLib.MainLoop()
+    loop.run()
 
-loop = GLib.MainLoop()
-loop.run()
\ No newline at end of file
+def stop():
+    """Undo start(), including the D-Bus worker thread DisplayConfig runs"""
+    global display_config, bus, _last_signal, _pending_refresh, _burst_start, _subscription, loop
+    if _pending_refresh is not None:
+        GLib.source_remove(_pending_refresh)
+        _pending_refresh = None
+        _burst_start = None
+    if _subscription is not None:
+        bus.signal_unsubscribe(_subscription)
+        _subscription = None
+    _signal_gaps.clear()
+    _last_signal = None
+    bus = None
+    display_config = None
+    stop_worker()
+    if loop is not None:
+        loop.quit()
+        loop = None
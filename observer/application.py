@@ -1,51 +1,162 @@
-from collections import defaultdict
-from logging import currentframe
-from gi.repository import GLib
-import dbus
+from gi.repository import Gio, GLib
+from operator import itemgetter
+import queue
+import sys
+import threading
 
 class DisplayMode:
+    """
+    A monitor mode unpacked once from its (siiddada{sv}) struct:
+    * mode_id: the mode id string
+    * width, height: the size in physical pixels
+    * frequency: refresh rate
+    * scale: scale preferred as per calculations
+    * supported_scale: scales supported by this mode
+    * properties: optional properties
+    * is_current: True if the mode is the current one
+    """
+    __slots__ = ("mode_id", "width", "height", "frequency", "scale",
+                 "supported_scale", "properties", "is_current", "_str")
+
     def __init__(self, mode_info):
-        self.mode_info = mode_info
+        (self.mode_id, self.width, self.height, self.frequency, self.scale,
+         self.supported_scale, self.properties) = mode_info
+        self.is_current = "is-current" in self.properties
+        self._str = f"{self.width}x{self.height}@{self.frequency}"
 
     def __str__(self):
-        return "%sx%s@%s" % (self.width, self.height, self.frequency)
-
-    def mode_id(self):
-        return self.mode_info[0]
+        return self._str
 
-    @property
-    def width(self):
-        """width in physical pixels"""
-        return self.mode_info[1]
 
-    @property
-    def height(self):
-        """height in physical pixels"""
-        return self.mode_info[2]
+class DBusWorker(threading.Thread):
+    """
+    Thread running its own GLib.MainContext, so that blocking D-Bus
+    calls to Mutter never stall the main loop. The DisplayConfig proxy
+    is created on this thread for the first job, and again for later
+    jobs if that failed (e.g. Mutter did not own its name yet); work is
+    queued with submit() and results are handed back to the default
+    main context through GLib.idle_add.
+    """
 
-    @property
-    def frequency(self):
-        """refresh rate"""
-        return self.mode_info[3]
-
-    @property
-    def scale(self):
-        """scale preferred as per calculations"""
-        return self.mode_info[4]
+    def __init__(self):
+        super().__init__(name="dbus-worker", daemon=True)
+        self.context = GLib.MainContext()
+        self.loop = GLib.MainLoop(self.context)
+        self.proxy = None
+        self._stopped = False
+        self._queue = queue.Queue()
+
+    def run(self):
+        self.context.push_thread_default()
+        try:
+            self.loop.run()
+        finally:
+            self.context.pop_thread_default()
+
+    def _connect(self):
+        # Only methods are called through the proxy: skip the
+        # GetAll of cached properties and the signal match rule
+        # (observer subscribes to MonitorsChanged on the bus).
+        return Gio.DBusProxy.new_for_bus_sync(
+            Gio.BusType.SESSION,
+            Gio.DBusProxyFlags.DO_NOT_LOAD_PROPERTIES
+            | Gio.DBusProxyFlags.DO_NOT_CONNECT_SIGNALS
+            | Gio.DBusProxyFlags.DO_NOT_AUTO_START,
+            None,
+            DisplayConfig.namespace,
+            DisplayConfig.dbus_path,
+            DisplayConfig.namespace,
+            None,
+        )
 
-    @property
-    def supported_scale(self):
-        """scales supported by this mode"""
-        return self.mode_info[5]
+    def stop(self):
+        self._stopped = True
+        # Quit from the worker context, so a stop() issued while the
+        # proxy is still being created is not lost before loop.run().
+        source = GLib.Idle()
+        source.set_callback(self._quit)
+        source.attach(self.context)
 
-    @property
-    def properties(self):
-        """optional properties"""
-        return self.mode_info[6]
+    def _quit(self, *user_data):
+        self.loop.quit()
+        return GLib.SOURCE_REMOVE
 
-    def is_current(self):
-        """Return True if the mode is the current one"""
-        return "is-current" in self.properties
+    def submit(self, func, args=(), on_done=None, on_error=None):
+        """
+        Run func(proxy, *args) on the worker thread. on_done is called
+        with the result, or on_error with the exception it raised (a
+        GLib.Error for failed D-Bus calls), on the main context. Raises
+        RuntimeError once the worker has been stopped, as nothing would
+        ever run the job.
+        """
+        if self._stopped:
+            raise RuntimeError("D-Bus worker is stopped; create a new DisplayConfig")
+        self._queue.put((func, args, on_done, on_error))
+        source = GLib.Idle()
+        source.set_callback(self._drain)
+        source.attach(self.context)
+
+    def _drain(self, *user_data):
+        while True:
+            try:
+                func, args, on_done, on_error = self._queue.get_nowait()
+            except queue.Empty:
+                return GLib.SOURCE_REMOVE
+            try:
+                if self.proxy is None:
+                    self.proxy = self._connect()
+                result = func(self.proxy, *args)
+            except Exception as error:
+                GLib.idle_add(self._deliver, on_error or self._raise, error)
+                continue
+            if on_done is not None:
+                GLib.idle_add(self._deliver, on_done, result)
+
+    @staticmethod
+    def _deliver(callback, value):
+        callback(value)
+        return GLib.SOURCE_REMOVE
+
+    @staticmethod
+    def _raise(error):
+        raise error
+
+
+def _write_lines(lines):
+    # One write for the whole dump instead of a print() per line
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+def _call(proxy, method, parameters=None):
+    return proxy.call_sync(method, parameters, Gio.DBusCallFlags.NONE, -1, None).unpack()
+
+
+# Worker shared by every DisplayConfig for the lifetime of the process
+_worker = None
+
+# The one DisplayConfig of the process, see DisplayConfig.__new__
+_instance = None
+
+
+def _get_worker():
+    global _worker
+    if _worker is None:
+        _worker = DBusWorker()
+        _worker.start()
+    return _worker
+
+
+def stop_worker():
+    """
+    Stop the shared D-Bus worker thread and drop the DisplayConfig
+    singleton; the next DisplayConfig() starts both afresh.
+    """
+    global _worker, _instance
+    if _worker is not None:
+        _worker.stop()
+        _worker.join()
+        _worker = None
+    _instance = None
 
 
 class DisplayConfig():
@@ -58,13 +169,185 @@ class DisplayConfig():
     TEMPORARY_METHOD = 1
     PERSISTENT_METHOD = 2
 
-    def __init__(self):
-        session_bus = dbus.SessionBus()
-        proxy_obj = session_bus.get_object(self.namespace, self.dbus_path)
-        self.interface = dbus.Interface(proxy_obj, dbus_interface=self.namespace)
-        self.resources = self.interface.GetResources()
-        self.current_state = self.interface.GetCurrentState()
-        self.config_serial = self.current_state[0]
+    # (serial, method, logical_monitors, properties) where each logical
+    # monitor is (x, y, scale, transform, primary, [(connector, mode_id, properties)])
+    APPLY_MONITORS_CONFIG_SIGNATURE = "(uua(iiduba(ssa{sv}))a{sv})"
+
+    # Layouts understood by build_layout()
+    LAYOUT_MODES = ("single", "extend", "clone")
+
+    # "layout-mode" values of the current state properties
+    LOGICAL_LAYOUT_MODE = 1
+    PHYSICAL_LAYOUT_MODE = 2
+
+    def __new__(cls, on_ready=None, on_error=None):
+        global _instance
+        if _instance is None:
+            _instance = super().__new__(cls)
+            _instance._init_once()
+        return _instance
+
+    def _init_once(self):
+        self.worker = _get_worker()
+        self.resources = None
+        self.current_state = None
+        self.config_serial = None
+        self.derived = None
+        # (on_ready, on_error) pairs waiting for the first state
+        self._ready_callbacks = []
+        self._loading = False
+        self._load()
+
+    def __init__(self, on_ready=None, on_error=None):
+        """
+        DisplayConfig is a singleton: every call returns the same
+        instance. on_ready is called with it once the first state is
+        available, right away if it already is. If loading the first
+        state fails, on_error is called with the exception instead;
+        callers without on_error keep waiting for a later load. Each
+        call made while no state is loaded retries the load.
+        """
+        if on_ready is None and on_error is None:
+            return
+        if self.derived is not None:
+            if on_ready is not None:
+                on_ready(self)
+            return
+        self._ready_callbacks.append((on_ready, on_error))
+        if not self._loading:
+            self._load()
+
+    def _load(self):
+        self._loading = True
+        self.refresh(on_error=self._on_load_error)
+
+    def _on_load_error(self, error):
+        self._loading = False
+        if self.derived is not None:
+            # another refresh already loaded a state
+            return
+        waiting = []
+        notified = False
+        for on_ready, on_error in self._ready_callbacks:
+            if on_error is None:
+                waiting.append((on_ready, on_error))
+            else:
+                on_error(error)
+                notified = True
+        self._ready_callbacks = waiting
+        if not notified:
+            sys.stderr.write(f"DisplayConfig: loading the current state failed: {error}\n")
+
+    def _notify_ready(self):
+        callbacks, self._ready_callbacks = self._ready_callbacks, []
+        for on_ready, on_error in callbacks:
+            if on_ready is not None:
+                on_ready(self)
+
+    def fetch_resources(self, on_done=None, on_error=None):
+        """
+        Fetch GetResources into self.resources, which serial, crtcs,
+        outputs, modes and max_screen_* read from. It is only fetched on
+        demand since the MonitorsChanged path just needs the current
+        state, and it is reset to None whenever the serial changes, so
+        those accessors raise RuntimeError until it is fetched again.
+        on_done is called with this instance once resources is set.
+        """
+        self.worker.submit(
+            _call, ("GetResources",),
+            lambda resources: self._on_resources_ready(resources, on_done),
+            on_error,
+        )
+
+    def _get_resources(self):
+        if self.resources is None:
+            raise RuntimeError("resources not fetched for the current serial; "
+                               "call fetch_resources() first")
+        return self.resources
+
+    def _on_resources_ready(self, resources, on_done):
+        self.resources = resources
+        if on_done is not None:
+            on_done(self)
+
+    def refresh(self, on_done=None, on_error=None):
+        """
+        Fetch the current state and re-parse it only if its serial
+        changed. on_done is called with this instance once a new state
+        is available; nothing is called if the state is unchanged.
+        on_error is called with the exception if the call fails (a
+        GLib.Error for D-Bus errors), otherwise it is raised on the main
+        loop.
+        """
+        self.worker.submit(
+            _call, ("GetCurrentState",),
+            lambda current_state: self._on_state_ready(current_state, on_done),
+            on_error,
+        )
+
+    def _on_state_ready(self, current_state, on_done):
+        serial = current_state[0]
+        if serial == self.config_serial:
+            return
+        # Mutter sometimes bumps the serial without any visible change;
+        # keep the new serial for ApplyMonitorsConfig but skip the rest.
+        if self.current_state is not None and current_state[1:] == self.current_state[1:]:
+            self.config_serial = serial
+            self.current_state = current_state
+            self.resources = None
+            return
+        first_state = self.derived is None
+        self.config_serial = serial
+        self.current_state = current_state
+        self.derived = self._derive(current_state)
+        self.resources = None
+        if first_state:
+            self._loading = False
+            self._notify_ready()
+        if on_done is not None:
+            on_done(self)
+
+    @staticmethod
+    def _derive(current_state):
+        """Values computed once per serial from the current state"""
+        monitors = current_state[1]
+        modes_by_monitor = {}
+        available_modes = {}
+        current_modes = {}
+        by_connector = {}
+        mode_index = {}
+        monitor_headers = {}
+        for monitor in monitors:
+            monitor_info, modes, props = monitor
+            connector = monitor_info[0]
+            by_connector[connector] = monitor
+            monitor_headers[connector] = " ".join(map(str, monitor_info))
+            for mode in modes:
+                mode_index[(connector, f"{mode[1]}x{mode[2]}@{mode[3]}")] = mode[0]
+            # struct-of-arrays view of the monitor modes
+            soa = {
+                "ids": list(map(itemgetter(0), modes)),
+                "widths": list(map(itemgetter(1), modes)),
+                "heights": list(map(itemgetter(2), modes)),
+                "frequencies": list(map(itemgetter(3), modes)),
+                "scales": list(map(itemgetter(4), modes)),
+                "supported_scales": list(map(itemgetter(5), modes)),
+                "properties": list(map(itemgetter(6), modes)),
+            }
+            modes_by_monitor[connector] = soa
+            available_modes[connector] = list(map(str, soa["ids"]))
+            cur = next((mode for mode in modes if "is-current" in mode[6]), None)
+            if cur is not None:
+                current_modes[connector] = f"{cur[1]}x{cur[2]}@{cur[3]}"
+        return {
+            "monitors_count": len(monitors),
+            "modes_by_monitor": modes_by_monitor,
+            "available_modes": available_modes,
+            "current_modes": current_modes,
+            "by_connector": by_connector,
+            "mode_index": mode_index,
+            "monitor_headers": monitor_headers,
+        }
 
     @property
     def serial(self):
@@ -74,8 +357,10 @@ class DisplayConfig():
         and will be increased for every configuration change (so that
         mutter can detect that the new configuration is based on old
         state)
+        Only available once fetch_resources() has completed for the
+        current serial; raises RuntimeError otherwise.
         """
-        return self.resources[0]
+        return self._get_resources()[0]
 
     @property
     def crtcs(self):
@@ -116,8 +401,10 @@ class DisplayConfig():
 
         Note: all geometry information refers to the untransformed
         display.
+        Only available once fetch_resources() has completed for the
+        current serial; raises RuntimeError otherwise.
         """
-        return self.resources[1]
+        return self._get_resources()[1]
 
     @property
     def outputs(self):
@@ -161,8 +448,10 @@ class DisplayConfig():
                             applied to all outputs in the same clone group. In
                             general, it's expected that presentation or primary
                             outputs will not be cloned.
+        Only available once fetch_resources() has completed for the
+        current serial; raises RuntimeError otherwise.
         """
-        return self.resources[2]
+        return self._get_resources()[2]
 
     @property
     def modes(self):
@@ -190,62 +479,95 @@ class DisplayConfig():
         projectors (if for example the kernel driver doesn't add the
         640x480 - 800x600 - 1024x768 default modes). Probably something
         that we need to handle in mutter anyway.
+        Only available once fetch_resources() has completed for the
+        current serial; raises RuntimeError otherwise.
         """
-        return self.resources[3]
+        return self._get_resources()[3]
 
     @property
     def max_screen_width(self):
-        return self.resources[4]
+        """Maximum screen width; needs fetch_resources() like serial"""
+        return self._get_resources()[4]
 
     @property
     def max_screen_height(self):
-        return self.resources[5]
+        """Maximum screen height; needs fetch_resources() like serial"""
+        return self._get_resources()[5]
 
     @property
     def monitors_count(self):
-        return len(self.current_state[1])
+        return self.derived["monitors_count"]
+
+    @property
+    def modes_by_monitor(self):
+        """Modes of each monitor as parallel lists, keyed by connector"""
+        return self.derived["modes_by_monitor"]
     
     def available_modes(self, monitor):
         # print("Available Monitor Modes")
-        modes = monitor[1]
-        mode_list = [str(mode[0]) for mode in modes]
-        return mode_list
+        return self.derived["available_modes"][monitor[0][0]]
+
+    def get_monitor(self, connector):
+        """Return the monitor struct attached to connector, or None"""
+        return self.derived["by_connector"].get(connector)
 
-    def get_monitor_serial(self):
+    def find_mode_id(self, connector, mode):
+        """Return the id of the "WxH@Hz" mode of connector, or None"""
+        return self.derived["mode_index"].get((connector, mode))
+
+    def get_monitor_serial(self, on_done=None, on_error=None):
+        """
+        Return "product serial" for each output, read from the
+        resources. Without on_done, fetch_resources() must have completed
+        for the current serial. With on_done, resources are fetched if
+        needed and on_done is called with the list instead.
+        """
+        if on_done is not None:
+            if self.resources is not None:
+                on_done(self.get_monitor_serial())
+            else:
+                self.fetch_resources(lambda config: on_done(config.get_monitor_serial()), on_error)
+            return None
         serial_list = [None]
         for i in range(self.monitors_count):
             serial_list.append(self.outputs[i][7]['product'] + ' ' + self.outputs[i][7]['serial'])
         return serial_list
 
-    def print_monitor_config(self, monitor):
-        print("Print Monitor Config")
+    def print_monitor_config(self, monitor, buf=None):
+        """Print the monitor config, or append its lines to buf if given"""
+        out = [] if buf is None else buf
+        out.append("Print Monitor Config")
         monitor_info, modes, props = monitor
-        print(' '.join(monitor_info))
-        for mode in modes:
-            # print(mode[0])
-            d_mode = DisplayMode(mode)
-            if d_mode.is_current():
-                print("Current: ",str(d_mode))
-        print(props)
+        connector = monitor_info[0]
+        header = self.derived["monitor_headers"].get(connector)
+        out.append(" ".join(monitor_info) if header is None else header)
+        current_mode = self.derived["current_modes"].get(connector)
+        if current_mode is not None:
+            out.append(f"Current:  {current_mode}")
+        out.append(str(props))
+        if buf is None:
+            _write_lines(out)
 
     def print_current_state(self):
         serial, monitors, logical_monitors, properties = self.current_state
-        print("Serial: %s" % serial)
-        print("Monitors num:",self.monitors_count)
+        out = [
+            f"Serial: {serial}",
+            f"Monitors num: {self.monitors_count}",
+        ]
         for monitor in monitors:
-            print("Available Monitor Modes")
-            print(self.available_modes(monitor))
-            self.print_monitor_config(monitor)
-        print("Logical monitors")
-        for monitor in logical_monitors:
-            print(monitor)
-        print("PROPS")
-        for prop in properties:
-            print("%s: %s" % (prop, properties[prop]))
+            out.append("Available Monitor Modes")
+            out.append(str(self.available_modes(monitor)))
+            self.print_monitor_config(monitor, out)
+        out.append("Logical monitors")
+        out.extend(map(str, logical_monitors))
+        out.append("PROPS")
+        out.extend(f"{prop}: {value}" for prop, value in properties.items())
+        _write_lines(out)
 
     def print_resources(self):
-        print(len(self.resources))
-        serial, monitors, logical_monitors, properties, max_screen_width, max_screen_height = self.resources
+        resources = self._get_resources()
+        print(len(resources))
+        serial, monitors, logical_monitors, properties, max_screen_width, max_screen_height = resources
         print("Serial: %s" % serial)
         print("Monitors")
         for monitor in monitors:
@@ -259,70 +581,73 @@ class DisplayConfig():
             print("%s: %s" % (prop, properties[prop]))
 
 
-    def apply_monitors_config(self):
-        scale = dbus.Double(1.0)
-        transform = dbus.UInt32(0)
-        is_primary = True
-        monitors = self.extand_mode(0,0,scale,transform,is_primary,[[dbus.String('DP-1'), dbus.String('1920x1200@59.950172424316406'), {}], 
-                                                                            [dbus.String('HDMI-1'), dbus.String('1920x1200@59.950172424316406'), {}]])
-        self.interface.ApplyMonitorsConfig(
+    def apply_monitors_config(self, monitors, method=TEMPORARY_METHOD, on_done=None, on_error=None):
+        """
+        Apply logical monitors as returned by build_layout(), e.g.
+        config.apply_monitors_config(config.build_layout(
+            "extend", [('DP-1', '1920x1200@59.950172424316406'),
+                       ('HDMI-1', '1920x1200@59.950172424316406')]))
+        """
+        parameters = GLib.Variant(self.APPLY_MONITORS_CONFIG_SIGNATURE, (
             self.config_serial,
-            1,
+            method,
             monitors,
             {}
+        ))
+        self.worker.submit(self._apply, (parameters,), on_done, on_error)
+
+    def _apply(self, proxy, parameters):
+        # Runs on the worker thread. ApplyMonitorsConfig replies with
+        # nothing, so call it on the connection and let GDBus check the
+        # empty reply type instead of unpacking it.
+        return proxy.get_connection().call_sync(
+            self.namespace,
+            self.dbus_path,
+            self.namespace,
+            "ApplyMonitorsConfig",
+            parameters,
+            GLib.VariantType.new("()"),
+            Gio.DBusCallFlags.NONE,
+            -1,
+            None,
         )
-    
-    def single_mode(self, x_position, y_position, scale, transform, is_primary, monitor_list, monitor_num):
-        count = self.monitors_count
-        monitors =[
-            [
-                x_position,
-                y_position,
-                scale,
-                transform,
-                is_primary,
-                [monitor_list[monitor_num]]
-            ]
-        ]
-        return monitors
-    
 
-    def extand_mode(self, x_position, y_position, scale, transform, is_primary, monitor_list):
-        count = self.monitors_count
-
-        # crtcs[i] = i'th monitor config
-        # crtcs[i][4] = current width setting
-        # crtcs[i][5] = current height setting
-        monitor_width_height = [[self.crtcs[i][4],self.crtcs[i][5]] for i in range(count)]
-
-        monitors = []
-        for i in range(count):
-            monitors.append([
-                    x_position,
-                    y_position,
-                    scale,
-                    transform,
-                    True if i == 0 else False,
-                    [monitor_list[i]]
-                ])
-
-        # TODO: Extand Location Set. Current is just right side extand...
-            x_position += monitor_width_height[i][0]
-
-        # print(monitors)
-        return monitors
-
-
-    def clone_mode(self, x_position, y_position, scale, transform, is_primary, monitor_list):
-        count = self.monitors_count
+    def build_layout(self, mode, monitor_list, x_position=0, y_position=0, scale=1.0, transform=0):
+        """
+        Build the logical monitors for ApplyMonitorsConfig from
+        monitor_list, a list of (connector, "WxH@Hz") pairs:
+        * single: only the first monitor, as primary; the others are
+                  ignored and their modes not checked
+        * extend: one logical monitor each, laid out left to right
+        * clone: all monitors in a single logical monitor
+        """
+        if mode not in self.LAYOUT_MODES:
+            raise ValueError("unknown layout mode %s" % mode)
+        if mode == "single":
+            monitor_list = monitor_list[:1]
         monitors = []
-        monitors.append([
-                x_position,
-                y_position,
-                scale,
-                transform,
-                True,
-                [monitor_list[i] for i in range(count)]
-            ])
-        # print(monitors)
-        return monitors
\ No newline at end of file
+        for connector, monitor_mode in monitor_list:
+            mode_id = self.find_mode_id(connector, monitor_mode)
+            if mode_id is None:
+                raise ValueError("%s has no mode %s" % (connector, monitor_mode))
+            monitors.append((connector, mode_id, {}))
+
+        if mode == "single":
+            return [(x_position, y_position, scale, transform, True, monitors)]
+        if mode == "clone":
+            return [(x_position, y_position, scale, transform, True, monitors)]
+        # In the logical layout mode (the Wayland default) positions are
+        # in scaled coordinates, in the physical one in pixels.
+        logical = self.current_state[3].get("layout-mode") == self.LOGICAL_LAYOUT_MODE
+        # Transforms rotated by 90 or 270 degrees (flipped or not) are
+        # odd; the mode height is then the width on screen.
+        rotated = transform % 2 == 1
+        layout = []
+        for i, (connector, mode_id, props) in enumerate(monitors):
+            layout.append((x_position, y_position, scale, transform, i == 0,
+                           [(connector, mode_id, props)]))
+            soa = self.modes_by_monitor[connector]
+            index = soa["ids"].index(mode_id)
+            width = soa["heights"][index] if rotated else soa["widths"][index]
+            x_position += round(width / scale) if logical else width
+        return layout